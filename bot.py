@@ -1,5 +1,9 @@
 import logging
 import sqlite3
+import csv
+import io
+import re
+import hashlib
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
@@ -71,6 +75,26 @@ def init_database():
     )
     ''')
 
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS payments (
+        payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        transaction_key TEXT UNIQUE,
+        user_id INTEGER,
+        amount INTEGER,
+        reference TEXT,
+        payment_date TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS balances (
+        user_id INTEGER PRIMARY KEY,
+        amount INTEGER DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+
     conn.commit()
 
 # Yangi a'zoni kutish
@@ -114,7 +138,8 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("📝 Uy vazifasi berish", callback_data="assign_task")],
         [InlineKeyboardButton("👥 Obunachilar ro'yxati", callback_data="subscribers_list")],
-        [InlineKeyboardButton("⏰ Yaqin to'lovchilar", callback_data="upcoming_payments")]
+        [InlineKeyboardButton("⏰ Yaqin to'lovchilar", callback_data="upcoming_payments")],
+        [InlineKeyboardButton("💳 To'lovlarni import qilish", callback_data="import_payments")]
     ]
     
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -570,6 +595,343 @@ async def upcoming_payments(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.edit_message_text(message_text, reply_markup=reply_markup)
 
+# Ko'chirma ustunlari uchun mumkin bo'lgan nomlar
+STATEMENT_USER_ID_COLUMNS = ('user_id', 'telegram_id')
+STATEMENT_REFERENCE_COLUMNS = ('reference', 'ref', 'izoh', 'description', 'comment')
+STATEMENT_AMOUNT_COLUMNS = ('amount', 'summa', 'sum')
+STATEMENT_TRANSACTION_COLUMNS = ('transaction_id', 'txn_id')
+STATEMENT_DATE_COLUMNS = ('date', 'datetime', 'time', 'sana', 'vaqt', 'payment_date')
+
+# Summa formati: minglik ajratgichli yoki oddiy butun qism, ixtiyoriy 1-2 xonali kasr qism
+AMOUNT_PATTERN = re.compile(r'^(\d{1,3}(?:([.,])\d{3})(?:\2\d{3})*|\d+)(?:([.,])\d{1,2})?$')
+
+# Hisobotda ko'rsatiladigan qatorlar soni (qolganlari CSV faylda)
+STATEMENT_PREVIEW_ROWS = 10
+
+# Hisobotdagi izoh uzunligi va Telegram xabarining maksimal uzunligi
+STATEMENT_REFERENCE_PREVIEW = 40
+MESSAGE_MAX_LENGTH = 4096
+
+# Ko'chirma yuborish uchun kutish vaqti
+STATEMENT_UPLOAD_TIMEOUT = timedelta(minutes=10)
+
+# Ko'chirma ustunini topish
+def find_statement_column(fieldnames, candidates):
+    for name in fieldnames:
+        if name and name.strip().lower() in candidates:
+            return name
+    return None
+
+# Summani songa aylantirish ("50 000,00", "50.000,00", "50,000.00" yoki "50000" ko'rinishida)
+def parse_amount(value):
+    value = (value or '').replace(' ', '').replace('\xa0', '').replace("'", '')
+    match = AMOUNT_PATTERN.match(value)
+    if not match:
+        raise ValueError(value)
+
+    integer_part, thousands, decimal = match.groups()
+    if thousands and thousands == decimal:
+        raise ValueError(value)
+    return int(integer_part.replace(thousands or ',', ''))
+
+# Foydalanuvchilarni qidirish uchun indekslar (har biri bitta so'rov bilan)
+def build_payment_index():
+    cursor.execute('SELECT user_id, username, subscription_end, penalty_count FROM users')
+    users_by_id = {}
+    users_by_username = {}
+    for user_id, username, subscription_end, penalty_count in cursor.fetchall():
+        users_by_id[user_id] = (subscription_end, penalty_count or 0)
+        if username:
+            users_by_username[username.lower()] = user_id
+
+    cursor.execute('SELECT user_id, amount FROM balances')
+    balances = dict(cursor.fetchall())
+
+    cursor.execute('SELECT transaction_key FROM payments WHERE transaction_key IS NOT NULL')
+    imported_keys = {row[0] for row in cursor.fetchall()}
+
+    return users_by_id, users_by_username, balances, imported_keys
+
+# Ko'chirma manbasi: sarlavha ustunlari bo'yicha (har bir bank eksporti o'z formatiga ega)
+def statement_source(fieldnames):
+    header = '\x1f'.join((name or '').strip().lower() for name in fieldnames)
+    return hashlib.sha256(header.encode('utf-8')).hexdigest()[:12]
+
+# Qatorning takrorlanmas kaliti: tranzaksiya ID si yoki sana bilan birga qator xeshi.
+# Ikkalasi ham bo'lmasa, takroriy import tekshirilmaydi (None).
+def statement_row_key(row, fieldnames, source, transaction_column, date_column, row_counts):
+    transaction_id = (row.get(transaction_column) or '').strip() if transaction_column else ''
+    if transaction_id:
+        return f"{source}:txn:{transaction_id}"
+
+    if not date_column or not (row.get(date_column) or '').strip():
+        return None
+
+    values = '\x1f'.join((row.get(name) or '').strip() for name in fieldnames if name is not None)
+    row_hash = hashlib.sha256(values.encode('utf-8')).hexdigest()
+
+    # Bir fayldagi bir xil qatorlar alohida to'lovlar hisoblanadi
+    row_counts[row_hash] = row_counts.get(row_hash, 0) + 1
+    return f"{source}:row:{row_hash}:{row_counts[row_hash]}"
+
+# Ko'chirmani oqim sifatida o'qish va to'lovlarni foydalanuvchilarga moslash
+def match_statement(stream, users_by_id, users_by_username, imported_keys):
+    sample = stream.read(4096)
+    stream.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+
+    reader = csv.DictReader(stream, dialect=dialect)
+    fieldnames = reader.fieldnames or []
+    user_id_column = find_statement_column(fieldnames, STATEMENT_USER_ID_COLUMNS)
+    reference_column = find_statement_column(fieldnames, STATEMENT_REFERENCE_COLUMNS)
+    amount_column = find_statement_column(fieldnames, STATEMENT_AMOUNT_COLUMNS)
+    transaction_column = find_statement_column(fieldnames, STATEMENT_TRANSACTION_COLUMNS)
+    date_column = find_statement_column(fieldnames, STATEMENT_DATE_COLUMNS)
+
+    if amount_column is None or (user_id_column is None and reference_column is None):
+        raise ValueError("Ko'chirmada 'amount' va 'user_id' yoki 'reference' ustunlari bo'lishi kerak")
+
+    source = statement_source(fieldnames)
+    max_amount = config.MONTHLY_PAYMENT * config.STATEMENT_MAX_MONTHS
+
+    matched = []
+    unmatched = []
+    duplicates = []
+    unchecked = 0
+    row_counts = {}
+    seen_keys = set()
+    for row in reader:
+        line = reader.line_num
+        reference = ' '.join(
+            (row.get(column) or '').strip() for column in (user_id_column, reference_column) if column
+        ).strip()
+        amount_text = (row.get(amount_column) or '').strip()
+
+        key = statement_row_key(row, fieldnames, source, transaction_column, date_column, row_counts)
+        if key is None:
+            unchecked += 1
+        elif key in imported_keys or key in seen_keys:
+            duplicates.append((line, reference, amount_text, "Avval import qilingan"))
+            continue
+
+        try:
+            amount = parse_amount(amount_text)
+        except ValueError:
+            unmatched.append((line, reference, amount_text, "Summa noto'g'ri"))
+            continue
+
+        if amount <= 0:
+            unmatched.append((line, reference, amount_text, "Summa musbat emas"))
+            continue
+
+        if amount > max_amount:
+            unmatched.append((line, reference, amount_text, f"Summa {config.STATEMENT_MAX_MONTHS} oylik to'lovdan katta"))
+            continue
+
+        # Faqat ID ustuni yoki izohdagi aniq @username bo'yicha moslash
+        candidates = set()
+        raw_user_id = (row.get(user_id_column) or '').strip() if user_id_column else ''
+        if raw_user_id:
+            if raw_user_id.isdigit() and int(raw_user_id) in users_by_id:
+                candidates.add(int(raw_user_id))
+            else:
+                unmatched.append((line, reference, amount_text, "Foydalanuvchi ID si topilmadi"))
+                continue
+
+        if reference_column:
+            for username in re.findall(r'@(\w+)', row.get(reference_column) or ''):
+                if username.lower() in users_by_username:
+                    candidates.add(users_by_username[username.lower()])
+
+        if not candidates:
+            unmatched.append((line, reference, amount_text, "Foydalanuvchi topilmadi"))
+            continue
+
+        if len(candidates) > 1:
+            unmatched.append((line, reference, amount_text, "Noaniq: bir nechta foydalanuvchiga mos"))
+            continue
+
+        if key is not None:
+            seen_keys.add(key)
+        matched.append((line, key, candidates.pop(), amount, reference))
+
+    return matched, unmatched, duplicates, unchecked
+
+# To'lovlarni saqlash, jarimalarni yopish va obunani uzaytirish (bitta tranzaksiyada)
+def apply_payments(matched, users_by_id, balances):
+    now = datetime.now()
+
+    paid = {}
+    for line, key, user_id, amount, reference in matched:
+        paid[user_id] = paid.get(user_id, 0) + amount
+
+    results = []
+    user_updates = []
+    balance_updates = []
+    for user_id, amount in paid.items():
+        subscription_end, penalty_count = users_by_id[user_id]
+        available = balances.get(user_id, 0) + amount
+
+        # Avval jarimalar, keyin butun oylar uchun to'lov; qoldiq balansda saqlanadi
+        settled = min(penalty_count, available // config.PENALTY_AMOUNT)
+        available -= settled * config.PENALTY_AMOUNT
+        months = available // config.MONTHLY_PAYMENT if settled == penalty_count else 0
+        leftover = available - months * config.MONTHLY_PAYMENT
+
+        new_end = None
+        if months:
+            current_end = datetime.fromisoformat(subscription_end) if subscription_end else now
+            new_end = max(current_end, now) + relativedelta(months=months)
+            user_updates.append((new_end, penalty_count - settled, user_id))
+        else:
+            user_updates.append((subscription_end, penalty_count - settled, user_id))
+
+        balance_updates.append((user_id, leftover))
+        results.append((user_id, amount, settled, months, leftover, new_end))
+
+    with conn:
+        conn.executemany('INSERT INTO payments (transaction_key, user_id, amount, reference, payment_date) VALUES (?, ?, ?, ?, ?)',
+                         [(key, user_id, amount, reference, now) for line, key, user_id, amount, reference in matched])
+        conn.executemany('UPDATE users SET subscription_end = ?, penalty_count = ? WHERE user_id = ?', user_updates)
+        conn.executemany('INSERT OR REPLACE INTO balances (user_id, amount) VALUES (?, ?)', balance_updates)
+
+    return results
+
+# To'lovlarni import qilish
+async def import_payments(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    if query.from_user.id not in config.ADMINS:
+        await query.edit_message_text("❌ Sizga ruxsat yo'q!")
+        return
+
+    context.user_data['awaiting_statement'] = datetime.now()
+
+    message_text = "💳 Bank yoki to'lov tizimi ko'chirmasini .csv fayl sifatida yuboring.\n\n"
+    message_text += "Kerakli ustunlar: amount va user_id yoki reference (izohda @username).\n"
+    message_text += "Takroriy importni aniqlash uchun transaction_id yoki date ustuni bo'lishi kerak."
+
+    keyboard = [
+        [InlineKeyboardButton("❌ Bekor qilish", callback_data="import_cancel")]
+    ]
+
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(message_text, reply_markup=reply_markup)
+
+# To'lovlar importini bekor qilish
+async def import_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    context.user_data.pop('awaiting_statement', None)
+    await query.edit_message_text("❌ To'lovlar importi bekor qilindi.")
+
+# Izohni hisobot uchun qisqartirish
+def shorten_reference(reference):
+    if len(reference) > STATEMENT_REFERENCE_PREVIEW:
+        return reference[:STATEMENT_REFERENCE_PREVIEW - 1] + '…'
+    return reference or '-'
+
+# Ko'chirma faylini qabul qilish
+async def receive_statement(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    requested_at = context.user_data.get('awaiting_statement')
+    if requested_at is None:
+        return
+
+    if update.effective_user.id not in config.ADMINS:
+        return
+
+    if datetime.now() - requested_at > STATEMENT_UPLOAD_TIMEOUT:
+        del context.user_data['awaiting_statement']
+        await update.message.reply_text("⏰ Kutish vaqti tugadi. Admin panelidan importni qaytadan boshlang.")
+        return
+
+    document = update.message.document
+    if not (document.file_name or '').lower().endswith('.csv'):
+        await update.message.reply_text("❌ Faqat .csv fayl qabul qilinadi. Boshqa fayl yuboring.")
+        return
+
+    if document.file_size and document.file_size > config.STATEMENT_MAX_SIZE:
+        await update.message.reply_text(f"❌ Fayl juda katta. Maksimal hajm: {config.STATEMENT_MAX_SIZE // (1024 * 1024)} MB.")
+        return
+
+    del context.user_data['awaiting_statement']
+
+    statement_file = await document.get_file()
+    data = await statement_file.download_as_bytearray()
+    stream = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', errors='replace', newline='')
+
+    users_by_id, users_by_username, balances, imported_keys = build_payment_index()
+    try:
+        matched, unmatched, duplicates, unchecked = match_statement(stream, users_by_id, users_by_username, imported_keys)
+    except (ValueError, csv.Error) as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+
+    try:
+        results = apply_payments(matched, users_by_id, balances)
+    except (sqlite3.Error, ValueError, OverflowError) as e:
+        logger.error(f"To'lovlarni saqlashda xatolik: {e}")
+        await update.message.reply_text("❌ To'lovlarni saqlab bo'lmadi. Hech qanday o'zgarish kiritilmadi.")
+        return
+
+    renewed = [result for result in results if result[3]]
+    underpaid = [result for result in results if not result[3]]
+
+    message_text = "📊 To'lovlar hisoboti:\n\n"
+    message_text += f"✅ Obunasi uzaytirildi: {len(renewed)} ta\n"
+    message_text += f"⚠️ Oylik to'lovga yetmadi: {len(underpaid)} ta\n"
+    message_text += f"💰 Balansga yozilgan qoldiq: jami {sum(result[4] for result in results)} so'm\n"
+    message_text += f"🔁 Avval import qilingan: {len(duplicates)} ta\n"
+    message_text += f"❓ Topilmagan qatorlar: {len(unmatched)} ta\n"
+
+    if unchecked:
+        message_text += f"\n⚠️ {unchecked} ta qatorda transaction_id yoki sana yo'q, takroriy import tekshirilmadi!\n"
+
+    if renewed:
+        message_text += "\n✅ Obunasi uzaytirildi:\n"
+        for user_id, amount, settled, months, leftover, new_end in renewed[:STATEMENT_PREVIEW_ROWS]:
+            message_text += f"   👤 {user_id}: {amount} so'm, {months} oy, {new_end.strftime('%Y-%m-%d')} gacha, qoldiq {leftover} so'm\n"
+
+    if underpaid:
+        message_text += "\n⚠️ Oylik to'lovga yetmadi:\n"
+        for user_id, amount, settled, months, leftover, new_end in underpaid[:STATEMENT_PREVIEW_ROWS]:
+            message_text += f"   👤 {user_id}: {amount} so'm, {settled} ta jarima yopildi, balansga {leftover} so'm\n"
+
+    for title, rows in (("🔁 Avval import qilingan", duplicates), ("❓ Topilmagan qatorlar", unmatched)):
+        if rows:
+            message_text += f"\n{title}:\n"
+            for line, reference, amount_text, reason in rows[:STATEMENT_PREVIEW_ROWS]:
+                message_text += f"   {line}-qator: {shorten_reference(reference)} | {shorten_reference(amount_text)} — {reason}\n"
+
+    truncated = max(len(renewed), len(underpaid), len(duplicates), len(unmatched)) > STATEMENT_PREVIEW_ROWS
+    if len(message_text) > MESSAGE_MAX_LENGTH:
+        message_text = message_text[:MESSAGE_MAX_LENGTH - 1] + '…'
+        truncated = True
+
+    await update.message.reply_text(message_text)
+
+    # Ro'yxatlar qisqartirilgan bo'lsa, to'liq hisobotni fayl sifatida yuborish
+    if truncated:
+        report = io.StringIO()
+        writer = csv.writer(report)
+        writer.writerow(['status', 'line', 'user_id', 'reference', 'amount', 'penalties_settled', 'months', 'subscription_end', 'leftover', 'reason'])
+        for user_id, amount, settled, months, leftover, new_end in results:
+            status = 'renewed' if months else 'underpaid'
+            writer.writerow([status, '', user_id, '', amount, settled, months, new_end.strftime('%Y-%m-%d') if new_end else '', leftover, ''])
+        for status, rows in (('duplicate', duplicates), ('unmatched', unmatched)):
+            for line, reference, amount_text, reason in rows:
+                writer.writerow([status, line, '', reference, amount_text, '', '', '', '', reason])
+
+        await update.message.reply_document(
+            document=io.BytesIO(report.getvalue().encode('utf-8-sig')),
+            filename="payments_report.csv"
+        )
+
 # Admin paneliga qaytish
 async def admin_panel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -618,6 +980,8 @@ def main():
     application.add_handler(CallbackQueryHandler(daily_report, pattern="^daily_report_"))
     application.add_handler(CallbackQueryHandler(subscribers_list, pattern="^subscribers_list$"))
     application.add_handler(CallbackQueryHandler(upcoming_payments, pattern="^upcoming_payments$"))
+    application.add_handler(CallbackQueryHandler(import_payments, pattern="^import_payments$"))
+    application.add_handler(CallbackQueryHandler(import_cancel, pattern="^import_cancel$"))
     application.add_handler(CallbackQueryHandler(admin_panel_callback, pattern="^admin_back$"))
     application.add_handler(CallbackQueryHandler(admin_panel_callback, pattern="^understand_reason$"))
     application.add_handler(CallbackQueryHandler(admin_panel_callback, pattern="^understand_warning$"))
@@ -625,6 +989,7 @@ def main():
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, receive_task_text))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, receive_reason))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, receive_daily_report))
+    application.add_handler(MessageHandler(filters.Document.ALL & filters.ChatType.PRIVATE, receive_statement))
     
     # Botni ishga tushirish
     application.run_polling()
@@ -18,3 +18,9 @@ PENALTY_AMOUNT = 2000
 
 # Oylik to'lov miqdori (so'mda)
 MONTHLY_PAYMENT = 50000
+
+# To'lov ko'chirmasi faylining maksimal hajmi (baytda)
+STATEMENT_MAX_SIZE = 5 * 1024 * 1024
+
+# Ko'chirmaning bitta qatori uchun maksimal to'lov (oylarda)
+STATEMENT_MAX_MONTHS = 12